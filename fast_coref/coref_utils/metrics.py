@@ -17,6 +17,11 @@ class CorefEvaluator(object):
         for e in self.evaluators:
             e.update(predicted, gold, mention_to_predicted, mention_to_gold)
 
+    def update_batch(self, batch):
+        """Update with (predicted, gold, mention_to_predicted, mention_to_gold) tuples of multiple documents."""
+        for e in self.evaluators:
+            e.update_batch(batch)
+
     def get_f1(self):
         return sum(e.get_f1() for e in self.evaluators) / len(self.evaluators)
 
@@ -39,12 +44,24 @@ class Evaluator(object):
         self.metric = metric
         self.beta = beta
 
-    def update(self, predicted, gold, mention_to_predicted, mention_to_gold):
+    def get_doc_counts(self, predicted, gold, mention_to_predicted, mention_to_gold):
         if self.metric == ceafe:
-            pn, pd, rn, rd = self.metric(predicted, gold)
+            return self.metric(predicted, gold)
         else:
             pn, pd = self.metric(predicted, mention_to_gold)
             rn, rd = self.metric(gold, mention_to_predicted)
+            return pn, pd, rn, rd
+
+    def update(self, predicted, gold, mention_to_predicted, mention_to_gold):
+        self.update_batch([(predicted, gold, mention_to_predicted, mention_to_gold)])
+
+    def update_batch(self, batch):
+        # Sum the counts over the documents before updating the totals
+        doc_counts = [self.get_doc_counts(*doc_args) for doc_args in batch]
+        if not doc_counts:
+            return
+
+        pn, pd, rn, rd = map(sum, zip(*doc_counts))
         self.p_num += pn
         self.p_den += pd
         self.r_num += rn
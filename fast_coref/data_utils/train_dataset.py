@@ -0,0 +1,143 @@
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+from typing import Dict, List, Optional, Iterator
+
+
+def identity_collate(document: Dict) -> Dict:
+    """Collate function for the single document "batches" used in training."""
+    return document
+
+
+def get_training_length(
+    document: Dict, max_training_segments: Optional[int] = None
+) -> int:
+    """Returns the number of tokens of the document used in training.
+
+    Documents are truncated to max_training_segments segments in training. The length of
+    the first max_training_segments segments is used as a proxy for the truncated length.
+    """
+    return sum(document["sent_len_list"][:max_training_segments])
+
+
+def get_length_buckets(
+    documents: List[Dict],
+    bucket_size: int,
+    rng: np.random.RandomState,
+    max_training_segments: Optional[int] = None,
+) -> List[List[Dict]]:
+    """Splits documents into buckets of bucket_size documents of similar training lengths.
+
+    Documents are sorted by training length and the documents are shuffled within each bucket.
+    """
+
+    # Random permutation to break ties between documents of the same length
+    documents = [documents[idx] for idx in rng.permutation(len(documents))]
+    doc_lens = [
+        get_training_length(document, max_training_segments) for document in documents
+    ]
+    sorted_indices = np.argsort(doc_lens, kind="stable")
+
+    buckets = []
+    for start_idx in range(0, len(documents), bucket_size):
+        bucket = sorted_indices[start_idx : start_idx + bucket_size]
+        rng.shuffle(bucket)
+        buckets.append([documents[idx] for idx in bucket])
+
+    return buckets
+
+
+class CorefTrainDataset(IterableDataset):
+    """Iterable dataset over the tensorized training documents.
+
+    Every pass over the dataset corresponds to one training "epoch" which may not
+    correspond to an actual epoch, since datasets used in joint training can be subsampled.
+    The document order of an epoch is derived from a seed shared by all the dataloader workers,
+    so each worker can stride over its share of the same permutation.
+    If bucket_size is specified, documents are shuffled within buckets of similar training lengths.
+    Buckets are formed per dataset so that documents of different datasets aren't grouped by length.
+    In distributed training, each process (rank) iterates over a disjoint shard of the epoch,
+    with all the shards having the same number of documents.
+    """
+
+    def __init__(
+        self,
+        train_data_map: Dict[str, List[Dict]],
+        num_train_docs_map: Dict[str, Optional[int]],
+        seed: int = 0,
+        bucket_size: Optional[int] = None,
+        max_training_segments: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
+    ) -> None:
+        self.train_data_map = train_data_map
+        self.num_train_docs_map = num_train_docs_map
+        self.bucket_size = bucket_size
+        self.max_training_segments = max_training_segments
+        self.seed = seed
+        self.epoch = 0
+        self.rank = rank
+        self.world_size = world_size
+
+    def __len__(self) -> int:
+        return self.get_num_epoch_docs() // self.world_size
+
+    def get_num_epoch_docs(self) -> int:
+        num_docs = 0
+        for dataset, dataset_train_data in self.train_data_map.items():
+            num_train_docs = self.num_train_docs_map.get(dataset, None)
+            if num_train_docs is not None:
+                num_docs += num_train_docs
+            else:
+                num_docs += len(dataset_train_data)
+
+        return num_docs
+
+    def get_epoch_data(self, rng: np.random.RandomState) -> List[Dict]:
+        """Subsample and shuffle the training documents for one epoch."""
+
+        train_data, buckets = [], []
+        for dataset, dataset_train_data in self.train_data_map.items():
+            num_train_docs = self.num_train_docs_map.get(dataset, None)
+            if num_train_docs is not None:
+                # Subsampling the data - This is useful in joint training
+                random_indices = rng.choice(len(dataset_train_data), num_train_docs)
+                dataset_train_data = [dataset_train_data[idx] for idx in random_indices]
+
+            if self.bucket_size:
+                buckets += get_length_buckets(
+                    dataset_train_data,
+                    self.bucket_size,
+                    rng,
+                    max_training_segments=self.max_training_segments,
+                )
+            else:
+                train_data += dataset_train_data
+
+        if self.bucket_size:
+            # Shuffle the order of the buckets of all the datasets
+            return [
+                document
+                for bucket_idx in rng.permutation(len(buckets))
+                for document in buckets[bucket_idx]
+            ]
+        else:
+            # Shuffle the concatenated examples
+            return [train_data[idx] for idx in rng.permutation(len(train_data))]
+
+    def __iter__(self) -> Iterator[Dict]:
+        rng = np.random.RandomState((self.seed + self.epoch) % (2**32))
+        self.epoch += 1
+
+        train_data = self.get_epoch_data(rng)
+        if self.world_size > 1:
+            # The permutation is shared across ranks since they use the same seed.
+            # Ranks need to process the same number of documents to stay in sync.
+            num_shard_docs = len(train_data) // self.world_size
+            train_data = train_data[self.rank :: self.world_size][:num_shard_docs]
+
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            # Each worker yields a disjoint slice of the epoch
+            train_data = train_data[worker_info.id :: worker_info.num_workers]
+
+        return iter(train_data)
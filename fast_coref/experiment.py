@@ -1,30 +1,45 @@
 import sys
 import os
+import copy
+import contextlib
 import time
+import math
 import logging
 import torch
 import json
 import numpy as np
 import random
+import hashlib
 import wandb
 
 from omegaconf import OmegaConf
 from os import path
 from collections import OrderedDict
-from transformers import get_linear_schedule_with_warmup
+from concurrent.futures import Future, ThreadPoolExecutor
 from transformers import AutoModel, AutoTokenizer
 
-from data_utils.utils import load_dataset, load_eval_dataset
+from data_utils.utils import load_dataset, load_eval_dataset, get_data_file
 import pytorch_utils.utils as utils
 
 from model.entity_ranking_model import EntityRankingModel
 from data_utils.tensorize_dataset import TensorizeDataset
-from pytorch_utils.optimization_utils import get_inverse_square_root_decay
+from data_utils.train_dataset import CorefTrainDataset, identity_collate
+from pytorch_utils.modules import TrainingForward
+from pytorch_utils.optimization_utils import (
+    get_adamw,
+    get_inverse_square_root_lambda,
+    get_linear_decay_lambda,
+    merge_optimizer_state_dicts,
+    merge_scheduler_state_dicts,
+)
 
 from utils_evaluate import coref_evaluation
 
-from typing import Dict, Union, List, Optional
+from typing import Dict, List, Optional
 from omegaconf import DictConfig
+from torch.nn.parallel import DistributedDataParallel
+from torch.optim.lr_scheduler import LambdaLR
+from torch.utils.data import DataLoader
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger()
@@ -35,6 +50,8 @@ class Experiment:
 
     def __init__(self, config: DictConfig):
         self.config = config
+        # Set up distributed training if launched with multiple processes (e.g. via torchrun)
+        self._init_distributed()
 
         # Whether to train or not
         self.eval_model: bool = not self.config.train
@@ -49,6 +66,17 @@ class Experiment:
         # Initialize model path attributes
         self.model_path = self.config.paths.model_path
         self.best_model_path = self.config.paths.best_model_path
+        # Checkpoints are written to disk in a background thread
+        self.checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+        # Pending write and pinned memory snapshot per checkpoint location
+        self.checkpoint_futures: Dict[str, Future] = {}
+        self.checkpoint_snapshots: Dict[str, utils.PinnedSnapshot] = {}
+        # Mixed precision dtype - None if mixed precision is disabled
+        self.amp_dtype: Optional[torch.dtype] = utils.get_amp_dtype(
+            self.config.trainer.get("amp_dtype", None),
+            gradient_checkpointing=self._uses_gradient_checkpointing(),
+        )
+        logger.info(f"Mixed precision dtype: {self.amp_dtype}")
 
         if not self.eval_model:
             # Step 1 - Initialize model
@@ -65,6 +93,14 @@ class Experiment:
             if self._is_training_remaining():
                 self.train()
 
+            # The final evaluation loads the saved checkpoints
+            self.wait_for_checkpoints()
+
+        if not utils.is_main_process():
+            # Final evaluation is carried out by the main process
+            torch.distributed.destroy_process_group()
+            return
+
         # Perform final evaluation
         if path.exists(self.best_model_path):
             # Step 1 - Initialize model
@@ -77,12 +113,54 @@ class Experiment:
             logger.info("No model accessible!")
             sys.exit(1)
 
+    def _init_distributed(self) -> None:
+        """Initializes the process group for distributed data parallel training.
+
+        The world size and ranks are read from the environment variables set by torchrun.
+        Each process uses the GPU corresponding to its local rank.
+        """
+
+        self.local_rank: int = int(os.environ.get("LOCAL_RANK", 0))
+        if int(os.environ.get("WORLD_SIZE", 1)) <= 1 or utils.is_distributed():
+            return
+
+        if torch.cuda.is_available():
+            torch.cuda.set_device(self.local_rank)
+            torch.distributed.init_process_group(backend="nccl")
+        else:
+            torch.distributed.init_process_group(backend="gloo")
+
+        if not utils.is_main_process():
+            # Logging is left to the main process
+            logger.setLevel(logging.WARNING)
+
+        logger.info(f"Distributed training with {utils.get_world_size()} processes")
+
+    def _uses_gradient_checkpointing(self) -> bool:
+        """Whether the document encoder is trained with gradient checkpointing."""
+
+        doc_encoder_config: DictConfig = self.config.model.doc_encoder
+        return (
+            doc_encoder_config.finetune
+            and doc_encoder_config.get("gradient_checkpointing", True)
+            # Gradient checkpointing is disabled for DDP training in _build_model
+            and utils.get_world_size() == 1
+        )
+
     def _build_model(self) -> None:
         """Constructs the model with given config."""
 
         model_params: DictConfig = self.config.model
         train_config: DictConfig = self.config.trainer
 
+        if utils.get_world_size() > 1 and model_params.doc_encoder.get(
+            "gradient_checkpointing", True
+        ):
+            # The encoder uses reentrant checkpointing which recomputes the forward pass in
+            # backward. DDP then marks the checkpointed params ready twice and fails.
+            logger.info("Encoder gradient checkpointing is disabled for DDP training")
+            model_params.doc_encoder.gradient_checkpointing = False
+
         self.model = EntityRankingModel(
             model_config=model_params, train_config=train_config
         )
@@ -90,10 +168,42 @@ class Experiment:
         if torch.cuda.is_available():
             self.model.cuda()
 
+        # State dict keys saved in the checkpoint, i.e., all except the document encoder keys
+        self.model_save_keys: List[str] = [
+            key for key in self.model.state_dict() if "lm_encoder." not in key
+        ]
+
+        self._compile_model()
+
         # Print model
         utils.print_model_info(self.model)
         sys.stdout.flush()
 
+    def _compile_model(self) -> None:
+        """Compiles the forward passes of the model with torch.compile if specified in the config.
+
+        The methods rather than the module are compiled so that the model's state dict is unaffected.
+        Dynamic shapes are used because the document lengths vary, and graph breaks are allowed
+        since the clustering module has data-dependent control flow.
+        """
+
+        if not self.config.trainer.get("use_compile", False):
+            return
+
+        if not hasattr(torch, "compile"):
+            logger.info("torch.compile requires torch>=2.0, using the eager model")
+            return
+
+        compile_kwargs = {
+            "mode": "reduce-overhead",
+            "fullgraph": False,
+            "dynamic": True,
+        }
+        self.model.forward_training = torch.compile(
+            self.model.forward_training, **compile_kwargs
+        )
+        self.model.forward = torch.compile(self.model.forward, **compile_kwargs)
+
     def _load_data(self):
         """Loads and processes the training and evaluation data.
 
@@ -110,7 +220,10 @@ class Experiment:
         """
 
         self.num_train_docs_map, self.data_iter_map, self.conll_data_dir = {}, {}, {}
+        self.train_data_on_gpu = False
         raw_data_map = {}
+        # Attributes which determine the tensorized data of a dataset
+        cache_attributes_map = {}
 
         max_segment_len: int = self.config.model.doc_encoder.transformer.max_segment_len
         model_name: str = self.config.model.doc_encoder.transformer.name
@@ -144,6 +257,13 @@ class Experiment:
                 data_dir = path.join(data_dir, str(attributes.get("cross_val_split")))
 
             logger.info("Data directory: %s" % data_dir)
+            cache_attributes_map[dataset_name] = {
+                "data_dir": data_dir,
+                "singleton_file": singleton_file,
+                "num_dev_docs": num_dev_docs,
+                "num_test_docs": num_test_docs,
+                "max_segment_len": max_segment_len,
+            }
 
             # CoNLL data dir
             if attributes.get("has_conll", False):
@@ -186,8 +306,13 @@ class Experiment:
 
             for dataset in raw_data_map:
                 for split in raw_data_map[dataset]:
-                    self.data_iter_map[split][dataset] = data_processor.tensorize_data(
-                        raw_data_map[dataset][split], training=False
+                    self.data_iter_map[split][dataset] = self._tensorize_data(
+                        data_processor,
+                        raw_data_map[dataset][split],
+                        cache_path=self._get_tensorized_cache_path(
+                            data_processor, dataset, split, cache_attributes_map
+                        ),
+                        training=False,
                     )
         else:
             # Training
@@ -195,10 +320,17 @@ class Experiment:
                 self.data_iter_map[split] = {}
                 training = split == "train"
                 for dataset in raw_data_map:
-                    self.data_iter_map[split][dataset] = data_processor.tensorize_data(
-                        raw_data_map[dataset][split], training=training
+                    self.data_iter_map[split][dataset] = self._tensorize_data(
+                        data_processor,
+                        raw_data_map[dataset][split],
+                        cache_path=self._get_tensorized_cache_path(
+                            data_processor, dataset, split, cache_attributes_map
+                        ),
+                        training=training,
                     )
 
+            self._cache_train_data_on_gpu()
+
             # Estimate number of training steps
             if self.config.trainer.eval_per_k_steps is None:
                 # Eval steps is 1 epoch (with subsampling) of all the datasets used in joint training
@@ -206,6 +338,13 @@ class Experiment:
                     self.num_train_docs_map.values()
                 )
 
+            if utils.get_world_size() > 1:
+                # Eval steps count documents over all the processes, while the steps are counted
+                # per process, which goes through its share of the documents
+                self.config.trainer.eval_per_k_steps = max(
+                    1, self.config.trainer.eval_per_k_steps // utils.get_world_size()
+                )
+
             self.config.trainer.num_training_steps = (
                 self.config.trainer.eval_per_k_steps * self.config.trainer.max_evals
             )
@@ -213,6 +352,107 @@ class Experiment:
                 f"Number of training steps: {self.config.trainer.num_training_steps}"
             )
 
+    def _cache_train_data_on_gpu(self) -> None:
+        """Moves the tensorized training data to GPU if it fits in the GPU cache budget.
+
+        For small datasets such as LitBank, this avoids host to device copies during training.
+        """
+
+        train_config: DictConfig = self.config.trainer
+        if not (train_config.get("cache_on_gpu", False) and torch.cuda.is_available()):
+            return
+
+        # Budget in GB
+        gpu_cache_budget: float = train_config.get("gpu_cache_budget", 1.0)
+        train_data_size = sum(
+            utils.get_tensor_bytes(document)
+            for dataset_train_data in self.data_iter_map["train"].values()
+            for document in dataset_train_data
+        ) / (1024**3)
+
+        if train_data_size > gpu_cache_budget:
+            logger.info(
+                "Training data (%.2f GB) exceeds the GPU cache budget of %.2f GB"
+                % (train_data_size, gpu_cache_budget)
+            )
+            return
+
+        for dataset, dataset_train_data in self.data_iter_map["train"].items():
+            self.data_iter_map["train"][dataset] = [
+                utils.move_to_device(document, self.model.device)
+                for document in dataset_train_data
+            ]
+
+        self.train_data_on_gpu = True
+        logger.info("Training data (%.2f GB) cached on GPU" % train_data_size)
+
+    def _get_tensorized_cache_path(
+        self,
+        data_processor: TensorizeDataset,
+        dataset: str,
+        split: str,
+        cache_attributes_map: Dict,
+    ) -> Optional[str]:
+        """Returns the cache file for the tensorized split, or None if caching is disabled.
+
+        The file name includes a hash of all the attributes which affect the tensorized data,
+        such as the tokenizer and the maximum segment length, so stale caches are not reused.
+        Hence the cache directory is shared across runs with different training configs.
+        """
+
+        cache_dir: Optional[str] = self.config.paths.get("tensorized_cache_dir", None)
+        if not (self.config.get("cache_tensorized_data", False) and cache_dir):
+            return None
+
+        # Concurrent runs or processes in distributed training can race to create the directory
+        os.makedirs(cache_dir, exist_ok=True)
+
+        cache_attributes = dict(cache_attributes_map[dataset])
+        # Invalidate the cache if the processed data is regenerated
+        data_file = get_data_file(
+            cache_attributes["data_dir"], split, cache_attributes["max_segment_len"]
+        )
+        if data_file is not None:
+            cache_attributes["data_mtime"] = path.getmtime(data_file)
+        singleton_file = cache_attributes["singleton_file"]
+        if singleton_file is not None and path.exists(singleton_file):
+            cache_attributes["singleton_mtime"] = path.getmtime(singleton_file)
+        cache_attributes.update(
+            {
+                "tokenizer": data_processor.tokenizer.name_or_path,
+                "vocab_size": len(data_processor.tokenizer),
+                "remove_singletons": data_processor.remove_singletons,
+                "eval_model": self.eval_model,
+            }
+        )
+        encoded = json.dumps(cache_attributes, sort_keys=True).encode()
+        cache_hash = hashlib.md5(encoded).hexdigest()
+
+        return path.join(cache_dir, f"tensorized_{dataset}_{split}_{cache_hash}.pt")
+
+    @staticmethod
+    def _tensorize_data(
+        data_processor: TensorizeDataset,
+        split_data: List[Dict],
+        cache_path: Optional[str] = None,
+        training: bool = False,
+    ) -> List[Dict]:
+        """Tensorizes the split data, reusing the tensorized data cached by a previous run."""
+
+        if cache_path is not None and path.exists(cache_path):
+            logger.info(f"Loading tensorized data from {cache_path}")
+            return torch.load(cache_path, map_location="cpu")
+
+        tensorized_data = data_processor.tensorize_data(split_data, training=training)
+        if cache_path is not None:
+            # Write to a temporary file first to avoid partially written caches
+            # Concurrent runs and processes in distributed training use separate temporary files
+            tmp_cache_path = cache_path + f".tmp{os.getpid()}"
+            torch.save(tensorized_data, tmp_cache_path)
+            os.replace(tmp_cache_path, cache_path)
+
+        return tensorized_data
+
     def _load_previous_checkpoint(self):
         """Loads the last checkpoint or best checkpoint."""
 
@@ -267,73 +507,84 @@ class Experiment:
 
         optimizer_config: DictConfig = self.config.optimizer
         train_config: DictConfig = self.config.trainer
-        self.optimizer, self.optim_scheduler = {}, {}
 
-        if torch.cuda.is_available():
-            # Gradient scaler required for mixed precision training
+        # With gradient accumulation, there's one optimizer step per accumulated set of documents
+        grad_accum_steps: int = train_config.get("gradient_accumulation_steps", 1)
+        num_optimizer_steps: int = math.ceil(
+            train_config.num_training_steps / grad_accum_steps
+        )
+
+        if self.amp_dtype == torch.float16:
+            # Gradient scaler required for FP16 mixed precision training
+            # BF16 has the same exponent range as FP32 and doesn't require loss scaling
             self.scaler = torch.cuda.amp.GradScaler()
         else:
             self.scaler = None
 
-        # Optimizer for clustering params
-        self.optimizer["mem"] = torch.optim.Adam(
-            self.model.get_params()[1], lr=optimizer_config.init_lr, eps=1e-6
-        )
-
+        # A single optimizer with separate param groups for the clustering params
+        # and the document encoder params, each with its own learning rate schedule
+        # Param group for clustering params - No warmup steps for these params
+        grouped_param = [
+            {
+                "params": self.model.get_params()[1],
+                "lr": optimizer_config.init_lr,
+                "weight_decay": 0.0,
+            }
+        ]
         if optimizer_config.lr_decay == "inv":
-            self.optim_scheduler["mem"] = get_inverse_square_root_decay(
-                self.optimizer["mem"], num_warmup_steps=0
-            )
+            lr_lambdas = [get_inverse_square_root_lambda(num_warmup_steps=0)]
         else:
-            # No warmup steps for model params
-            self.optim_scheduler["mem"] = get_linear_schedule_with_warmup(
-                self.optimizer["mem"],
-                num_warmup_steps=0,
-                num_training_steps=train_config.num_training_steps,
-            )
+            lr_lambdas = [
+                get_linear_decay_lambda(
+                    num_warmup_steps=0, num_training_steps=num_optimizer_steps
+                )
+            ]
 
         if self.config.model.doc_encoder.finetune:
-            # Optimizer for document encoder
+            # Param groups for document encoder
             no_decay = [
                 "bias",
                 "LayerNorm.weight",
             ]  # No weight decay for bias and layernorm weights
             encoder_params = self.model.get_params(named=True)[0]
-            grouped_param = [
-                {
-                    "params": [
-                        p
-                        for n, p in encoder_params
-                        if not any(nd in n for nd in no_decay)
-                    ],
-                    "lr": optimizer_config.fine_tune_lr,
-                    "weight_decay": 1e-2,
-                },
-                {
-                    "params": [
-                        p for n, p in encoder_params if any(nd in n for nd in no_decay)
-                    ],
-                    "lr": optimizer_config.fine_tune_lr,
-                    "weight_decay": 0.0,
-                },
-            ]
-
-            self.optimizer["doc"] = torch.optim.AdamW(
-                grouped_param, lr=optimizer_config.fine_tune_lr, eps=1e-6
+            grouped_param.extend(
+                [
+                    {
+                        "params": [
+                            p
+                            for n, p in encoder_params
+                            if not any(nd in n for nd in no_decay)
+                        ],
+                        "lr": optimizer_config.fine_tune_lr,
+                        "weight_decay": 1e-2,
+                    },
+                    {
+                        "params": [
+                            p
+                            for n, p in encoder_params
+                            if any(nd in n for nd in no_decay)
+                        ],
+                        "lr": optimizer_config.fine_tune_lr,
+                        "weight_decay": 0.0,
+                    },
+                ]
             )
 
-            # Scheduler for document encoder
-            num_warmup_steps = int(0.1 * train_config.num_training_steps)
+            # Schedule for document encoder
+            num_warmup_steps = int(0.1 * num_optimizer_steps)
             if optimizer_config.lr_decay == "inv":
-                self.optim_scheduler["doc"] = get_inverse_square_root_decay(
-                    self.optimizer["doc"], num_warmup_steps=num_warmup_steps
+                doc_lr_lambda = get_inverse_square_root_lambda(
+                    num_warmup_steps=num_warmup_steps
                 )
             else:
-                self.optim_scheduler["doc"] = get_linear_schedule_with_warmup(
-                    self.optimizer["doc"],
+                doc_lr_lambda = get_linear_decay_lambda(
                     num_warmup_steps=num_warmup_steps,
-                    num_training_steps=train_config.num_training_steps,
+                    num_training_steps=num_optimizer_steps,
                 )
+            lr_lambdas.extend([doc_lr_lambda, doc_lr_lambda])
+
+        self.optimizer = get_adamw(grouped_param, lr=optimizer_config.init_lr, eps=1e-6)
+        self.optim_scheduler = LambdaLR(self.optimizer, lr_lambdas)
 
     def train(self) -> None:
         """Method for training the model.
@@ -352,69 +603,153 @@ class Experiment:
 
         optimizer_config, train_config = self.config.optimizer, self.config.trainer
 
+        # The dataloader workers take care of subsampling and shuffling the training data,
+        # while pinned memory allows for asynchronous host to device copies.
+        # Training data already cached on GPU can't be shared with worker processes.
+        num_workers: int = (
+            0 if self.train_data_on_gpu else train_config.get("num_workers", 0)
+        )
+        # In distributed training, the ranks need to share the seed to shard the same permutation
+        train_dataset = CorefTrainDataset(
+            self.data_iter_map["train"],
+            self.num_train_docs_map,
+            seed=utils.broadcast_object(np.random.randint(2**31)),
+            bucket_size=train_config.get("bucket_size", None),
+            max_training_segments=train_config.get("max_training_segments", None),
+            rank=utils.get_rank(),
+            world_size=utils.get_world_size(),
+        )
+        train_loader = DataLoader(
+            train_dataset,
+            batch_size=None,
+            collate_fn=identity_collate,
+            num_workers=num_workers,
+            pin_memory=(torch.cuda.is_available() and not self.train_data_on_gpu),
+            persistent_workers=(num_workers > 0),
+        )
+        if self.train_data_on_gpu:
+            train_prefetcher = train_loader
+        else:
+            # Host to device copies are issued from a background thread
+            train_prefetcher = utils.DevicePrefetcher(train_loader, model.device)
+
+        # Parameters over which the gradient norm is clipped
+        encoder_params, task_params = model.get_params()
+        all_params = encoder_params + task_params
+
+        distributed: bool = utils.is_distributed()
+        if distributed:
+            # The gradients are synchronized via the forward pass of the DDP module
+            forward_training = DistributedDataParallel(
+                TrainingForward(model),
+                device_ids=([self.local_rank] if torch.cuda.is_available() else None),
+                find_unused_parameters=True,
+            )
+        else:
+            forward_training = model.forward_training
+
+        # Gradients are accumulated over multiple documents before each optimizer step
+        # The accumulation carries over across epochs, so there's exactly one optimizer step
+        # per grad_accum_steps documents as assumed by the learning rate schedules
+        grad_accum_steps: int = train_config.get("gradient_accumulation_steps", 1)
+        num_accum_docs = 0
+        # Log the peak memory of every logging interval
+        log_memory: bool = train_config.get("log_memory", False)
+
+        def optimizer_step() -> bool:
+            """Updates the model with the accumulated gradients. Returns False if the update is skipped."""
+            nonlocal num_accum_docs
+            num_accum_docs = 0
+
+            if scaler is not None:
+                # Unscale the gradients before clipping
+                scaler.unscale_(optimizer)
+
+            # Gradient clipping
+            # With loss scaling, the scaler skips the steps with non-finite gradients
+            try:
+                utils.clip_grad_norm(
+                    all_params,
+                    optimizer_config.max_gradient_norm,
+                    error_if_nonfinite=(scaler is None),
+                )
+            except RuntimeError:
+                optimizer.zero_grad(set_to_none=True)
+                return False
+
+            if scaler is not None:
+                scaler.step(optimizer)
+                scaler.update()
+            else:
+                optimizer.step()
+            scheduler.step()
+
+            optimizer.zero_grad(set_to_none=True)
+            return True
+
+        optimizer.zero_grad(set_to_none=True)
+
         start_time = time.time()
         eval_time = {"total_time": 0, "num_evals": 0}
         while True:
             logger.info("Steps done %d" % (self.train_info["global_steps"]))
 
-            # Shuffle and load the training data
-            train_data = []
-            for dataset, dataset_train_data in self.data_iter_map["train"].items():
-                np.random.shuffle(dataset_train_data)
+            for dataset in self.data_iter_map["train"]:
                 if self.num_train_docs_map.get(dataset, None) is not None:
-                    # Subsampling the data - This is useful in joint training
                     logger.info(
                         f"{dataset}: Subsampled {self.num_train_docs_map.get(dataset)}"
                     )
-                    random_indices = np.random.choice(
-                        len(dataset_train_data), self.num_train_docs_map.get(dataset)
-                    )
-                    train_data += [dataset_train_data[idx] for idx in random_indices]
-                else:
-                    train_data += dataset_train_data
 
-            # Shuffle the concatenated examples again
-            np.random.shuffle(train_data)
-            logger.info("Per epoch training steps: %d" % len(train_data))
-            encoder_params, task_params = model.get_params()
+            logger.info("Per epoch training steps: %d" % len(train_dataset))
 
             # Training "epoch" -> May not correspond to actual epoch
-            for cur_document in train_data:
+            for cur_document in train_prefetcher:
 
-                def handle_example(document: Dict) -> Union[None, float]:
+                def handle_example(document: Dict) -> Optional[torch.Tensor]:
+                    nonlocal num_accum_docs
                     self.train_info["global_steps"] += 1
-                    for key in optimizer:
-                        optimizer[key].zero_grad()
 
-                    loss_dict: Dict = model.forward_training(document)
-                    total_loss = loss_dict["total"]
-                    if total_loss is None or torch.isnan(total_loss):
+                    # In distributed training, the gradients are only synchronized for the
+                    # last of the accumulated documents
+                    if distributed and (num_accum_docs + 1 < grad_accum_steps):
+                        sync_context = forward_training.no_sync()
+                    else:
+                        sync_context = contextlib.nullcontext()
+
+                    with sync_context:
+                        with utils.get_autocast_context(self.amp_dtype):
+                            loss_dict: Dict = forward_training(document)
+                        total_loss = loss_dict["total"]
+                        if total_loss is None or not torch.isfinite(total_loss):
+                            return None
+
+                        # Average the loss over the accumulated documents
+                        accum_loss = total_loss / grad_accum_steps
+                        if scaler is not None:
+                            scaler.scale(accum_loss).backward()
+                        else:
+                            accum_loss.backward()
+
+                    num_accum_docs += 1
+                    if num_accum_docs == grad_accum_steps:
+                        if not optimizer_step():
+                            return None
+
+                    if loss_dict.get("invalid_loss", False):
                         return None
 
-                    total_loss.backward()
-
-                    # Gradient clipping
-                    try:
-                        for param_group in [encoder_params, task_params]:
-                            torch.nn.utils.clip_grad_norm_(
-                                param_group,
-                                optimizer_config.max_gradient_norm,
-                                error_if_nonfinite=True,
-                            )
-                    except RuntimeError:
-                        return None
-
-                    for key in optimizer:
-                        optimizer[key].step()
-                        scheduler[key].step()
-
-                    return total_loss.item()
+                    # The loss is only copied to host when it's logged
+                    return total_loss.detach()
 
                 loss = handle_example(cur_document)
-                if loss is None:
+                if loss is None and not distributed:
                     continue
 
-                if self.train_info["global_steps"] % train_config.log_frequency == 0:
+                if (loss is not None) and (
+                    self.train_info["global_steps"] % train_config.log_frequency == 0
+                ):
+                    loss = loss.item()
+                    # Without resets, the peak memory is tracked since the last evaluation
                     max_mem = (
                         (torch.cuda.max_memory_allocated() / (1024**3))
                         if torch.cuda.is_available()
@@ -423,16 +758,20 @@ class Experiment:
                     if self.train_info.get("max_mem", 0.0) < max_mem:
                         self.train_info["max_mem"] = max_mem
 
-                    logger.info(
-                        "{} {:.3f} Max mem {:.1f} GB".format(
-                            cur_document["doc_key"],
-                            loss,
-                            max_mem,
+                    if log_memory:
+                        logger.info(
+                            "{} {:.3f} Max mem {:.1f} GB".format(
+                                cur_document["doc_key"],
+                                loss,
+                                max_mem,
+                            )
                         )
-                    )
+                        # Peak memory per logging interval
+                        if torch.cuda.is_available():
+                            torch.cuda.reset_peak_memory_stats()
+                    else:
+                        logger.info("{} {:.3f}".format(cur_document["doc_key"], loss))
                     sys.stdout.flush()
-                    if torch.cuda.is_available():
-                        torch.cuda.reset_peak_memory_stats()
                     if self.config.use_wandb:
                         wandb.log(
                             {
@@ -444,7 +783,13 @@ class Experiment:
                 if train_config.eval_per_k_steps and (
                     self.train_info["global_steps"] % train_config.eval_per_k_steps == 0
                 ):
-                    fscore = self.periodic_model_eval()
+                    fscore = None
+                    if utils.is_main_process():
+                        fscore = self.periodic_model_eval()
+                    # Other ranks need the updated training variables for stopping decisions
+                    fscore, self.train_info = utils.broadcast_object(
+                        (fscore, self.train_info)
+                    )
                     model.train()
                     # Get elapsed time
                     elapsed_time = time.time() - start_time
@@ -476,15 +821,18 @@ class Experiment:
                             % (avg_eval_time / 60, rem_time / 60)
                         )
 
-                        if rem_time < avg_eval_time:
+                        # All the ranks follow the decision of the main process
+                        if utils.broadcast_object(rem_time < avg_eval_time):
                             logger.info("Canceling job as not much time left")
                             if self.config.use_wandb:
                                 wandb.mark_preempting()
+                            self.wait_for_checkpoints()
                             sys.exit()
 
             # Check stopping criteria
             if not self._is_training_remaining():
                 break
+
             logger.handlers[0].flush()
 
     def _wandb_log(self, result_dict, dataset, split="dev"):
@@ -525,6 +873,7 @@ class Experiment:
                 self.data_iter_map,
                 dataset,
                 conll_data_dir=self.conll_data_dir,
+                amp_dtype=self.amp_dtype,
             )
             fscore_dict[dataset] = result_dict.get("fscore", 0.0)
             if self.config.use_wandb:
@@ -557,7 +906,7 @@ class Experiment:
         self.model.train()
         return fscore
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def perform_final_eval(self) -> None:
         """Method to evaluate the model after training has finished."""
 
@@ -602,6 +951,7 @@ class Experiment:
                     split=split,
                     final_eval=True,
                     conll_data_dir=self.conll_data_dir,
+                    amp_dtype=self.eval_amp_dtype,
                 )
                 if self.config.use_wandb:
                     self._wandb_log(result_dict, dataset=dataset, split=split)
@@ -657,6 +1007,12 @@ class Experiment:
             model_config.memory = self.config.model.memory
 
         self.config.model = config.model
+        # Inference uses the mixed precision the model was trained with
+        # Checkpoints without the setting were trained in full precision
+        self.eval_amp_dtype: Optional[torch.dtype] = utils.get_amp_dtype(
+            config.trainer.get("amp_dtype", None)
+        )
+        logger.info(f"Inference mixed precision dtype: {self.eval_amp_dtype}")
 
         self.train_info = checkpoint["train_info"]
 
@@ -678,6 +1034,8 @@ class Experiment:
         if torch.cuda.is_available():
             self.model.cuda()
 
+        self._compile_model()
+
     def load_model(self, location: str, last_checkpoint=True) -> None:
         """Load model from given location.
 
@@ -720,14 +1078,25 @@ class Experiment:
 
         if last_checkpoint:
             # If resuming training, restore the optimizer state as well
-            for param_group in checkpoint["optimizer"]:
-                self.optimizer[param_group].load_state_dict(
-                    checkpoint["optimizer"][param_group]
+            optimizer_state_dict = checkpoint["optimizer"]
+            scheduler_state_dict = checkpoint["scheduler"]
+            if "mem" in optimizer_state_dict:
+                # Checkpoints saved with separate optimizers for clustering and encoder params
+                param_groups = [
+                    param_group
+                    for param_group in ["mem", "doc"]
+                    if param_group in optimizer_state_dict
+                ]
+                optimizer_state_dict = merge_optimizer_state_dicts(
+                    [optimizer_state_dict[param_group] for param_group in param_groups]
                 )
-                self.optim_scheduler[param_group].load_state_dict(
-                    checkpoint["scheduler"][param_group]
+                scheduler_state_dict = merge_scheduler_state_dicts(
+                    [scheduler_state_dict[param_group] for param_group in param_groups]
                 )
 
+            self.optimizer.load_state_dict(optimizer_state_dict)
+            self.optim_scheduler.load_state_dict(scheduler_state_dict)
+
             if "scaler" in checkpoint and self.scaler is not None:
                 self.scaler.load_state_dict(checkpoint["scaler"])
 
@@ -744,17 +1113,13 @@ class Experiment:
                         If false, don't save optimizers and schedulers which take up a lot of space.
         """
 
-        model_state_dict = OrderedDict(self.model.state_dict())
-        doc_encoder_state_dict = {}
-
-        # Separate the doc_encoder state dict
         # We will save the model in two parts:
         # (a) Doc encoder parameters - Useful for final upload to huggingface
         # (b) Rest of the model parameters, optimizers, schedulers, and other bookkeeping variables
-        for key in self.model.state_dict():
-            if "lm_encoder." in key:
-                doc_encoder_state_dict[key] = model_state_dict[key]
-                del model_state_dict[key]
+        state_dict = self.model.state_dict()
+        model_state_dict = OrderedDict(
+            (key, state_dict[key]) for key in self.model_save_keys
+        )
 
         # Save the document encoder params
         if self.config.model.doc_encoder.finetune:
@@ -779,7 +1144,6 @@ class Experiment:
             "model": model_state_dict,
             "rng_state": torch.get_rng_state(),
             "np_rng_state": np.random.get_state(),
-            "config": self.config,
         }
 
         if self.scaler is not None:
@@ -787,19 +1151,36 @@ class Experiment:
 
         if last_checkpoint:
             # For last checkpoint save the optimizer and scheduler states as well
-            save_dict["optimizer"] = {}
-            save_dict["scheduler"] = {}
-
-            param_groups: List[str] = (
-                ["mem", "doc"] if self.config.model.doc_encoder.finetune else ["mem"]
-            )
-            for param_group in param_groups:
-                save_dict["optimizer"][param_group] = self.optimizer[
-                    param_group
-                ].state_dict()
-                save_dict["scheduler"][param_group] = self.optim_scheduler[
-                    param_group
-                ].state_dict()
+            save_dict["optimizer"] = self.optimizer.state_dict()
+            save_dict["scheduler"] = self.optim_scheduler.state_dict()
+
+        # The snapshot buffers of a location can only be reused once its previous write is done
+        location = str(location)
+        if location in self.checkpoint_futures:
+            self.checkpoint_futures.pop(location).result()
+        if location not in self.checkpoint_snapshots:
+            self.checkpoint_snapshots[location] = utils.PinnedSnapshot()
+
+        # Snapshot the state on the main thread since training continues while it's written
+        save_dict = self.checkpoint_snapshots[location](save_dict)
+        save_dict["config"] = copy.deepcopy(self.config)
+
+        self.checkpoint_futures[location] = self.checkpoint_executor.submit(
+            self._write_checkpoint, save_dict, location
+        )
 
-        torch.save(save_dict, location)
+    @staticmethod
+    def _write_checkpoint(save_dict: Dict, location: os.PathLike) -> None:
+        # Write to a temporary file first to avoid partially written checkpoints
+        tmp_location = str(location) + ".tmp"
+        torch.save(save_dict, tmp_location)
+        os.replace(tmp_location, location)
         logger.info(f"Model saved at: {path.abspath(location)}")
+
+    def wait_for_checkpoints(self) -> None:
+        """Blocks until the checkpoints being saved in the background are written to disk."""
+
+        for future in self.checkpoint_futures.values():
+            # Raises the exception, if any, encountered while saving
+            future.result()
+        self.checkpoint_futures = {}
@@ -49,8 +49,8 @@ def main_train(config):
     config.paths.best_model_dir = path.join(config.paths.model_dir, "best")
 
     for model_dir in [config.paths.model_dir, config.paths.best_model_dir]:
-        if not path.exists(model_dir):
-            os.makedirs(model_dir)
+        # Processes in distributed training can race to create the directories
+        os.makedirs(model_dir, exist_ok=True)
 
     if config.paths.model_path is None:
         config.paths.model_path = path.abspath(
@@ -97,6 +97,10 @@ def main(config):
         if model_name.startswith(config.paths.model_name_prefix):
             model_name = model_name[len(config.paths.model_name_prefix) :]
 
+    # In distributed training, only the main process (rank 0) logs to wandb
+    if int(os.environ.get("RANK", 0)) != 0:
+        config.use_wandb = False
+
     if config.use_wandb:
         # Wandb Initialization
         try:
@@ -21,7 +21,7 @@ class BaseDocEncoder(nn.Module):
 
         gradient_checkpointing = False
         if config.finetune:
-            gradient_checkpointing = True
+            gradient_checkpointing = config.get("gradient_checkpointing", True)
             # if torch.cuda.is_available():
             #     memory_in_gb = torch.cuda.get_device_properties(0).total_memory // (
             #         1024**3
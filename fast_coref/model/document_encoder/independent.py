@@ -1,9 +1,11 @@
+import math
 import torch
+import torch.nn as nn
 from fast_coref.pytorch_utils.utils import get_sequence_mask
 from fast_coref.model.document_encoder.base_encoder import BaseDocEncoder
 
 from omegaconf import DictConfig
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from torch import Tensor
 
 
@@ -11,6 +13,33 @@ class IndependentDocEncoder(BaseDocEncoder):
     def __init__(self, config: DictConfig):
         super(IndependentDocEncoder, self).__init__(config)
 
+    def pad_to_multiple(
+        self, doc_tens: Tensor, sent_len_list: List[int], pad_to_multiple_of: int
+    ) -> Tuple[Tensor, Tensor]:
+        """Pads the encoder input length to a multiple of pad_to_multiple_of.
+
+        Rounding up the input length restricts the encoder to a small set of input shapes,
+        which allows the compiled graphs (and their CUDA graphs) to be reused across documents.
+        """
+
+        seq_len = doc_tens.shape[1]
+        padded_len = math.ceil(seq_len / pad_to_multiple_of) * pad_to_multiple_of
+        padded_len = max(
+            seq_len, min(padded_len, self.config.transformer.max_encoder_segment_len)
+        )
+
+        if padded_len > seq_len:
+            doc_tens = nn.functional.pad(
+                doc_tens, (0, padded_len - seq_len), value=self.tokenizer.pad_token_id
+            )
+
+        # Attend to the segment tokens along with the CLS and SEP tokens
+        input_lens = torch.tensor(sent_len_list, device=self.device) + 2
+        positions = torch.arange(padded_len, device=self.device)
+        attn_mask = (positions.unsqueeze(0) < input_lens.unsqueeze(1)).long()
+
+        return doc_tens, attn_mask
+
     def forward(self, document: Dict) -> Tensor:
         doc_tens = document["tensorized_sent"]
         if isinstance(doc_tens, list):
@@ -27,6 +56,12 @@ class IndependentDocEncoder(BaseDocEncoder):
                 torch.tensor(sent_len_list, device=self.device)
             )
 
+        pad_to_multiple_of: Optional[int] = self.config.get("pad_to_multiple_of", None)
+        if pad_to_multiple_of:
+            doc_tens, attn_mask = self.pad_to_multiple(
+                doc_tens, sent_len_list, pad_to_multiple_of
+            )
+
         if not self.config.finetune:
             with torch.no_grad():
                 outputs = self.lm_encoder(
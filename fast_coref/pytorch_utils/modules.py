@@ -1,3 +1,4 @@
+import torch
 import torch.nn as nn
 
 
@@ -31,3 +32,31 @@ class MLP(nn.Module):
 
     def forward(self, mlp_input):
         return self.fc_layers(mlp_input)
+
+
+class TrainingForward(nn.Module):
+    """Module whose forward pass is the training forward pass of the wrapped model.
+
+    DistributedDataParallel only synchronizes the gradients of passes through the module's
+    forward, hence the wrapped module is used for distributed training. Since all the processes
+    need to run the backward pass, an undefined or non-finite loss is replaced by a zero loss
+    over the trainable parameters and the loss dictionary is marked with "invalid_loss".
+    """
+
+    def __init__(self, model):
+        super(TrainingForward, self).__init__()
+        self.model = model
+
+    def forward(self, document):
+        loss_dict = self.model.forward_training(document)
+        total_loss = loss_dict["total"]
+        if total_loss is None or not torch.isfinite(total_loss):
+            loss_dict = dict(loss_dict)
+            loss_dict["total"] = sum(
+                param.sum() * 0.0
+                for param in self.model.parameters()
+                if param.requires_grad
+            )
+            loss_dict["invalid_loss"] = True
+
+        return loss_dict
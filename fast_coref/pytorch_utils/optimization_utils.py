@@ -1,7 +1,37 @@
+import inspect
+import torch
 from torch.optim.lr_scheduler import LambdaLR
 
 
-def get_inverse_square_root_decay(optimizer, num_warmup_steps=0, last_epoch=-1):
+def get_adamw(params, lr: float, eps: float = 1e-6, weight_decay: float = 0.0):
+    """AdamW optimizer using the fused implementation where available.
+
+    The fused CUDA kernel (torch>=2.0) updates all the parameter tensors in one launch.
+    Older versions fall back to the foreach (multi-tensor) implementation if it's supported.
+    """
+    params = list(params)
+    if len(params) and isinstance(params[0], dict):
+        all_params = [
+            param for param_group in params for param in param_group["params"]
+        ]
+    else:
+        all_params = params
+    # Fused implementation requires all the parameters to be on GPU
+    on_cuda = all(param.is_cuda for param in all_params)
+
+    optim_params = inspect.signature(torch.optim.AdamW).parameters
+    kwargs = {}
+    if "fused" in optim_params and torch.cuda.is_available() and on_cuda:
+        kwargs["fused"] = True
+    elif "foreach" in optim_params:
+        kwargs["foreach"] = True
+
+    return torch.optim.AdamW(
+        params, lr=lr, eps=eps, weight_decay=weight_decay, **kwargs
+    )
+
+
+def get_inverse_square_root_lambda(num_warmup_steps=0):
     def lr_lambda(current_step):
         if current_step < num_warmup_steps:
             return float(current_step) / float(max(1, num_warmup_steps))
@@ -11,4 +41,61 @@ def get_inverse_square_root_decay(optimizer, num_warmup_steps=0, last_epoch=-1):
             else:
                 return (1 / (current_step + 1)) ** 0.5
 
-    return LambdaLR(optimizer, lr_lambda, last_epoch)
+    return lr_lambda
+
+
+def get_linear_decay_lambda(num_warmup_steps, num_training_steps):
+    """Same multiplier as transformers' get_linear_schedule_with_warmup."""
+
+    def lr_lambda(current_step):
+        if current_step < num_warmup_steps:
+            return float(current_step) / float(max(1, num_warmup_steps))
+        return max(
+            0.0,
+            float(num_training_steps - current_step)
+            / float(max(1, num_training_steps - num_warmup_steps)),
+        )
+
+    return lr_lambda
+
+
+def get_inverse_square_root_decay(optimizer, num_warmup_steps=0, last_epoch=-1):
+    return LambdaLR(
+        optimizer, get_inverse_square_root_lambda(num_warmup_steps), last_epoch
+    )
+
+
+def merge_optimizer_state_dicts(state_dicts):
+    """Merges the state dicts of optimizers into the state dict of a single optimizer.
+
+    The param groups of the merged optimizer are assumed to follow the order of the state dicts.
+    Useful for loading checkpoints saved with a separate optimizer per parameter group.
+    """
+    merged_state_dict = {"state": {}, "param_groups": []}
+    offset = 0
+    for state_dict in state_dicts:
+        num_params = 0
+        for param_group in state_dict["param_groups"]:
+            merged_group = dict(param_group)
+            merged_group["params"] = [idx + offset for idx in param_group["params"]]
+            merged_state_dict["param_groups"].append(merged_group)
+            num_params += len(param_group["params"])
+
+        for idx, param_state in state_dict["state"].items():
+            merged_state_dict["state"][idx + offset] = param_state
+
+        offset += num_params
+
+    return merged_state_dict
+
+
+def merge_scheduler_state_dicts(state_dicts):
+    """Merges the state dicts of LambdaLR schedulers analogous to merge_optimizer_state_dicts."""
+    merged_state_dict = dict(state_dicts[0])
+    for key in ["base_lrs", "_last_lr", "lr_lambdas"]:
+        if key in merged_state_dict:
+            merged_state_dict[key] = [
+                val for state_dict in state_dicts for val in state_dict[key]
+            ]
+
+    return merged_state_dict
@@ -1,5 +1,12 @@
+import contextlib
+import inspect
+import queue
+import threading
+import warnings
 import torch
 
+from typing import Optional
+
 
 def print_model_info(model):
     """Prints model parameters and their total count"""
@@ -25,6 +32,293 @@ def enough_memory():
     return False
 
 
+def is_distributed() -> bool:
+    return torch.distributed.is_available() and torch.distributed.is_initialized()
+
+
+def get_rank() -> int:
+    return torch.distributed.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return torch.distributed.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def broadcast_object(obj, src: int = 0):
+    """Returns the object of the src process in distributed training, and the object as is otherwise."""
+    if not is_distributed():
+        return obj
+
+    obj_list = [obj]
+    torch.distributed.broadcast_object_list(obj_list, src=src)
+    return obj_list[0]
+
+
+def checkpoint_keeps_autocast_dtype() -> bool:
+    """Whether gradient checkpointing recomputes the forward pass with the original autocast dtype.
+
+    Before torch 1.13, the recomputation in backward always autocasts to FP16.
+    """
+    torch_version = tuple(int(part) for part in torch.__version__.split(".")[:2])
+    return torch_version >= (1, 13)
+
+
+def get_amp_dtype(
+    amp_dtype: Optional[str], gradient_checkpointing: bool = False
+) -> Optional[torch.dtype]:
+    """Returns the autocast dtype for mixed precision, or None if mixed precision is disabled.
+
+    The "auto" setting picks BF16 on GPUs which support it (Ampere onwards) and FP16 otherwise.
+    With gradient checkpointing on torch versions which recompute the forward pass in FP16,
+    BF16 falls back to FP16 (with loss scaling) to avoid mixing the two precisions.
+    """
+    if amp_dtype is None or not torch.cuda.is_available():
+        return None
+
+    if amp_dtype == "auto":
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    elif amp_dtype == "bf16":
+        dtype = torch.bfloat16
+    elif amp_dtype == "fp16":
+        dtype = torch.float16
+    else:
+        raise ValueError(f"Mixed precision dtype {amp_dtype} is not supported")
+
+    if (
+        dtype == torch.bfloat16
+        and gradient_checkpointing
+        and not checkpoint_keeps_autocast_dtype()
+    ):
+        if amp_dtype == "bf16":
+            warnings.warn(
+                "BF16 with gradient checkpointing requires torch>=1.13, using FP16 instead"
+            )
+        dtype = torch.float16
+
+    return dtype
+
+
+def get_autocast_context(amp_dtype: Optional[torch.dtype]):
+    """Returns the CUDA autocast context for the dtype, or a no-op context if dtype is None."""
+    if amp_dtype is None:
+        return contextlib.nullcontext()
+
+    return torch.autocast("cuda", dtype=amp_dtype)
+
+
+def move_to_device(obj, device, non_blocking=False):
+    """Moves the tensors of a tensorized document to the device.
+
+    Dictionaries are processed recursively. Lists are assumed to be homogeneous, so lists
+    of python objects such as token ids or clusters are passed along without traversal.
+    """
+    if torch.is_tensor(obj):
+        return obj.to(device, non_blocking=non_blocking)
+    elif isinstance(obj, dict):
+        return {
+            key: move_to_device(val, device, non_blocking=non_blocking)
+            for key, val in obj.items()
+        }
+    elif isinstance(obj, list) and len(obj) and torch.is_tensor(obj[0]):
+        return [elem.to(device, non_blocking=non_blocking) for elem in obj]
+    else:
+        return obj
+
+
+def clone_to_cpu(obj):
+    """Returns a snapshot of a (nested) state dict with the tensors copied to CPU.
+
+    Containers are copied as well so that later in-place updates don't affect the snapshot.
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    elif isinstance(obj, dict):
+        return type(obj)((key, clone_to_cpu(val)) for key, val in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(clone_to_cpu(elem) for elem in obj)
+    else:
+        return obj
+
+
+def get_tensor_bytes(obj) -> int:
+    """Returns the number of bytes occupied by the tensors of a tensorized document."""
+    if torch.is_tensor(obj):
+        return obj.element_size() * obj.nelement()
+    elif isinstance(obj, dict):
+        return sum(get_tensor_bytes(val) for val in obj.values())
+    elif isinstance(obj, list) and len(obj) and torch.is_tensor(obj[0]):
+        return sum(get_tensor_bytes(elem) for elem in obj)
+    else:
+        return 0
+
+
+def record_stream(obj, stream):
+    """Marks the tensors of a tensorized document as in use by the given stream."""
+    if torch.is_tensor(obj):
+        obj.record_stream(stream)
+    elif isinstance(obj, dict):
+        for val in obj.values():
+            record_stream(val, stream)
+    elif isinstance(obj, list) and len(obj) and torch.is_tensor(obj[0]):
+        for elem in obj:
+            elem.record_stream(stream)
+
+
+class DevicePrefetcher:
+    """Iterator which moves documents to the device in a background thread.
+
+    For CUDA devices the host to device copies are issued on a separate stream, so that the
+    copies for upcoming documents overlap with the computation of the current training step.
+    """
+
+    def __init__(self, iterable, device: torch.device, prefetch_factor: int = 2):
+        self.iterable = iterable
+        self.device = torch.device(device)
+        self.prefetch_factor = prefetch_factor
+
+    def __len__(self):
+        return len(self.iterable)
+
+    @staticmethod
+    def _put(doc_queue, stop_event, item) -> bool:
+        """Put item in the queue unless the consumer has stopped. Returns False if stopped."""
+        while not stop_event.is_set():
+            try:
+                doc_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _producer(self, doc_queue, stop_event, copy_stream):
+        try:
+            for document in self.iterable:
+                event = None
+                if copy_stream is not None:
+                    with torch.cuda.stream(copy_stream):
+                        document = move_to_device(
+                            document, self.device, non_blocking=True
+                        )
+                        event = torch.cuda.Event()
+                        event.record(copy_stream)
+                else:
+                    document = move_to_device(document, self.device)
+
+                if not self._put(doc_queue, stop_event, (document, event, None)):
+                    return
+        except Exception as exception:
+            self._put(doc_queue, stop_event, (None, None, exception))
+            return
+
+        self._put(doc_queue, stop_event, (None, None, None))
+
+    def __iter__(self):
+        copy_stream = None
+        if self.device.type == "cuda":
+            copy_stream = torch.cuda.Stream(device=self.device)
+
+        doc_queue = queue.Queue(maxsize=self.prefetch_factor)
+        stop_event = threading.Event()
+        thread = threading.Thread(
+            target=self._producer,
+            args=(doc_queue, stop_event, copy_stream),
+            daemon=True,
+        )
+        thread.start()
+
+        try:
+            while True:
+                document, event, exception = doc_queue.get()
+                if exception is not None:
+                    raise exception
+                if document is None:
+                    break
+
+                if event is not None:
+                    # Wait for the copy to finish before the document is consumed
+                    current_stream = torch.cuda.current_stream(self.device)
+                    current_stream.wait_event(event)
+                    # Tensors were allocated on the copy stream
+                    record_stream(document, current_stream)
+
+                yield document
+        finally:
+            stop_event.set()
+            thread.join()
+
+
+class PinnedSnapshot:
+    """Snapshots (nested) state dicts to CPU using reusable pinned memory buffers.
+
+    The device to host copies of all the CUDA tensors are issued asynchronously on a separate
+    stream with a single synchronization at the end. The buffers are allocated on the first
+    snapshot and reused later on, hence a snapshot is only valid until the next one is taken.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.copy_stream = None
+
+    def __call__(self, obj):
+        if not torch.cuda.is_available():
+            return clone_to_cpu(obj)
+
+        if self.copy_stream is None:
+            self.copy_stream = torch.cuda.Stream()
+
+        # Wait for the pending computation on the tensors before copying them
+        self.copy_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(self.copy_stream):
+            snapshot = self._copy(obj, ())
+        self.copy_stream.synchronize()
+
+        return snapshot
+
+    def _copy(self, obj, key_path):
+        if torch.is_tensor(obj):
+            if not obj.is_cuda:
+                return obj.detach().clone()
+
+            buffer = self.buffers.get(key_path, None)
+            if (
+                buffer is None
+                or buffer.shape != obj.shape
+                or buffer.dtype != obj.dtype
+            ):
+                buffer = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=True)
+                self.buffers[key_path] = buffer
+
+            buffer.copy_(obj.detach(), non_blocking=True)
+            return buffer
+        elif isinstance(obj, dict):
+            return type(obj)(
+                (key, self._copy(val, key_path + (key,))) for key, val in obj.items()
+            )
+        elif isinstance(obj, (list, tuple)):
+            return type(obj)(
+                self._copy(elem, key_path + (idx,)) for idx, elem in enumerate(obj)
+            )
+        else:
+            return obj
+
+
+def clip_grad_norm(parameters, max_norm: float, error_if_nonfinite: bool = False):
+    """Clips the global gradient norm of the parameters.
+
+    Uses the foreach kernels (torch>=2.0) where available to compute the norm with a single reduction.
+    """
+    clip_kwargs = {"error_if_nonfinite": error_if_nonfinite}
+    if "foreach" in inspect.signature(torch.nn.utils.clip_grad_norm_).parameters:
+        clip_kwargs["foreach"] = True
+
+    return torch.nn.utils.clip_grad_norm_(parameters, max_norm, **clip_kwargs)
+
+
 def get_sequence_mask(sequence_len):
     """Returns Sequence Mask.
     sequence_len: Tensor of size (B,) with entries indicating length of seq.
@@ -5,6 +5,7 @@ import json
 import torch
 from os import path
 from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
 
 from coref_utils.metrics import CorefEvaluator
 from coref_utils.conll import evaluate_conll
@@ -12,14 +13,123 @@ from coref_utils.utils import get_mention_to_cluster, is_aligned, filter_cluster
 
 from model.utils import action_sequences_to_clusters
 from model.entity_ranking_model import EntityRankingModel
+from pytorch_utils.utils import get_autocast_context
 
 from omegaconf import DictConfig
-from typing import Dict
+from typing import Dict, List, Optional, Set
 from torch import Tensor
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger()
 
+# Key under which the filtered gold clusters of a document are cached across evaluations
+GOLD_CACHE_KEY = "_gold_cache"
+
+
+def get_skip_keys(documents: List[Dict]) -> Set[str]:
+    """Returns the keys of the tensorized documents which are left out of the logs."""
+    skip_keys = {"tensorized_sent", GOLD_CACHE_KEY}
+    if len(documents):
+        skip_keys.update(
+            key for key, val in documents[0].items() if isinstance(val, Tensor)
+        )
+
+    return skip_keys
+
+
+def dump_json_line(log_example: Dict) -> str:
+    """Serializes the log entry as a JSON line, using orjson if it's installed."""
+    if orjson is not None:
+        return orjson.dumps(
+            log_example, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE
+        ).decode()
+
+    return json.dumps(log_example) + "\n"
+
+
+def postprocess_example(
+    example: Dict,
+    pred_mentions: List,
+    mention_scores: List,
+    gt_actions: List,
+    pred_actions: List,
+    cluster_threshold: int,
+    skip_keys: Set[str],
+) -> Dict:
+    """Converts the model output for an example to clusters and the log entry.
+
+    Only python objects are handled here, so the function can run in a worker thread
+    while the model processes the next example.
+
+    Args:
+            example: Tensorized document
+            pred_mentions, mention_scores, gt_actions, pred_actions: Model output for the document
+            cluster_threshold: Clusters smaller than the threshold are filtered out
+            skip_keys: Keys of the example which are left out of the log entry
+
+    Returns:
+            dict: Predicted, gold, and oracle clusters with their mention to cluster maps,
+                    the subtoken map, and the serialized log entry for the example.
+    """
+
+    # Process predicted clusters
+    raw_predicted_clusters = action_sequences_to_clusters(pred_actions, pred_mentions)
+    predicted_clusters = filter_clusters(
+        raw_predicted_clusters, threshold=cluster_threshold
+    )
+    mention_to_predicted = get_mention_to_cluster(predicted_clusters)
+
+    # The gold clusters don't change across evaluations, so they're computed once per threshold
+    gold_cache = example.setdefault(GOLD_CACHE_KEY, {})
+    if cluster_threshold not in gold_cache:
+        gold_clusters = filter_clusters(
+            example["clusters"], threshold=cluster_threshold
+        )
+        gold_cache[cluster_threshold] = (
+            gold_clusters,
+            get_mention_to_cluster(gold_clusters),
+        )
+    gold_clusters, mention_to_gold = gold_cache[cluster_threshold]
+
+    # Oracle clustering - Best performance possible given the predicted mentions
+    oracle_clusters = action_sequences_to_clusters(gt_actions, pred_mentions)
+    oracle_clusters = filter_clusters(oracle_clusters, threshold=cluster_threshold)
+    mention_to_oracle = get_mention_to_cluster(oracle_clusters)
+
+    if "orig_subtoken_map" in example:
+        subtoken_map = example["orig_subtoken_map"]
+    else:
+        subtoken_map = example["subtoken_map"]
+
+    log_example = {key: val for key, val in example.items() if key not in skip_keys}
+    log_example["pred_mentions"] = pred_mentions
+    log_example["mention_scores"] = mention_scores
+    if cluster_threshold != 1:
+        # For cluster threshold 1, raw and processed clusters are one and the same
+        log_example["raw_predicted_clusters"] = raw_predicted_clusters
+
+    log_example["gt_actions"] = gt_actions
+    log_example["pred_actions"] = pred_actions
+    log_example["predicted_clusters"] = predicted_clusters
+
+    return {
+        "predicted_clusters": predicted_clusters,
+        "mention_to_predicted": mention_to_predicted,
+        "gold_clusters": gold_clusters,
+        "mention_to_gold": mention_to_gold,
+        "oracle_clusters": oracle_clusters,
+        "mention_to_oracle": mention_to_oracle,
+        "subtoken_map": subtoken_map,
+        "doc_key": example["doc_key"],
+        "num_actions": len(pred_actions),
+        "log_line": dump_json_line(log_example),
+    }
+
 
 def full_coref_evaluation(
     config: DictConfig,
@@ -29,6 +139,7 @@ def full_coref_evaluation(
     split="dev",
     final_eval=False,
     conll_data_dir: Dict = None,
+    amp_dtype: Optional[torch.dtype] = None,
 ) -> Dict:
     """Function to evaluate full coreference chains.
 
@@ -41,6 +152,7 @@ def full_coref_evaluation(
             final_eval: Whether this is a periodic evaluation or final evaluation
                     For final evaluation, official CoNLL scores can be calculated if possible.
             conll_data_dir:  Data directory dictionary which maps datasets to their gold CoNLL files.
+            amp_dtype: Autocast dtype the model was trained with, None for full precision.
 
     Returns:
             dict: Dictionary with results for all the metrics.
@@ -72,65 +184,63 @@ def full_coref_evaluation(
         coref_predictions, subtoken_maps = {}, {}
 
         logger.info(f"Evaluating on {len(data_iter_map[split][dataset])} examples")
-        for example in data_iter_map[split][dataset]:
-            start_time = time.time()
-            pred_mentions, mention_scores, gt_actions, pred_actions = model(example)
-
-            # Process predicted clusters
-            raw_predicted_clusters = action_sequences_to_clusters(
-                pred_actions, pred_mentions
-            )
-            predicted_clusters = filter_clusters(
-                raw_predicted_clusters, threshold=cluster_threshold
-            )
-            mention_to_predicted = get_mention_to_cluster(predicted_clusters)
-
-            gold_clusters = filter_clusters(
-                example["clusters"], threshold=cluster_threshold
-            )
-            mention_to_gold = get_mention_to_cluster(gold_clusters)
-            evaluator.update(
-                predicted_clusters, gold_clusters, mention_to_predicted, mention_to_gold
-            )
-
-            elapsed_time = time.time() - start_time
-            inference_time += elapsed_time
-
-            coref_predictions[example["doc_key"]] = predicted_clusters
-            if "orig_subtoken_map" in example:
-                subtoken_maps[example["doc_key"]] = example["orig_subtoken_map"]
-            else:
-                subtoken_maps[example["doc_key"]] = example["subtoken_map"]
-
-            total_actions += len(pred_actions)
-
-            # Oracle clustering - Best performance possible given the predicted mentions
-            oracle_clusters = action_sequences_to_clusters(gt_actions, pred_mentions)
-            oracle_clusters = filter_clusters(
-                oracle_clusters, threshold=cluster_threshold
-            )
-            mention_to_oracle = get_mention_to_cluster(oracle_clusters)
-            oracle_evaluator.update(
-                oracle_clusters, gold_clusters, mention_to_oracle, mention_to_gold
-            )
+        skip_keys = get_skip_keys(data_iter_map[split][dataset])
+        # The CPU postprocessing of an example runs in worker threads while the
+        # model performs inference on the following examples
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = []
+            for example in data_iter_map[split][dataset]:
+                start_time = time.time()
+                with get_autocast_context(amp_dtype):
+                    pred_mentions, mention_scores, gt_actions, pred_actions = model(
+                        example
+                    )
+                inference_time += time.time() - start_time
+
+                futures.append(
+                    executor.submit(
+                        postprocess_example,
+                        example,
+                        pred_mentions,
+                        mention_scores,
+                        gt_actions,
+                        pred_actions,
+                        cluster_threshold,
+                        skip_keys,
+                    )
+                )
 
-            log_example = dict(example)
-            log_example["pred_mentions"] = pred_mentions
-            log_example["mention_scores"] = mention_scores
-            if cluster_threshold != 1:
-                # For cluster threshold 1, raw and processed clusters are one and the same
-                log_example["raw_predicted_clusters"] = raw_predicted_clusters
+            # Results are gathered in order so that the log file follows the data order
+            start_time = time.time()
+            pending, oracle_pending = [], []
+            for future in futures:
+                output = future.result()
+                pending.append(
+                    (
+                        output["predicted_clusters"],
+                        output["gold_clusters"],
+                        output["mention_to_predicted"],
+                        output["mention_to_gold"],
+                    )
+                )
+                oracle_pending.append(
+                    (
+                        output["oracle_clusters"],
+                        output["gold_clusters"],
+                        output["mention_to_oracle"],
+                        output["mention_to_gold"],
+                    )
+                )
 
-            log_example["gt_actions"] = gt_actions
-            log_example["pred_actions"] = pred_actions
-            log_example["predicted_clusters"] = predicted_clusters
+                coref_predictions[output["doc_key"]] = output["predicted_clusters"]
+                subtoken_maps[output["doc_key"]] = output["subtoken_map"]
+                total_actions += output["num_actions"]
 
-            del log_example["tensorized_sent"]
-            for key in list(log_example.keys()):
-                if isinstance(log_example[key], Tensor):
-                    del log_example[key]
+                f.write(output["log_line"])
 
-            f.write(json.dumps(log_example) + "\n")
+            evaluator.update_batch(pending)
+            oracle_evaluator.update_batch(oracle_pending)
+            inference_time += time.time() - start_time
 
         result_dict: Dict = OrderedDict()
         perf_str: str = ""
@@ -238,6 +348,7 @@ def targeted_coref_evaluation(
     data_iter_map: Dict,
     dataset: str,
     split="test",
+    amp_dtype: Optional[torch.dtype] = None,
 ) -> Dict:
     """Function to perform targeted coreference evaluation for datasets such as GAP.
 
@@ -256,14 +367,16 @@ def targeted_coref_evaluation(
         logger.info(f"Evaluating on {len(data_iter_map[split][dataset])} examples")
         # Counter for keeping track of the key stats
         counter: Dict = Counter()
+        skip_keys = get_skip_keys(data_iter_map[split][dataset])
         for document in data_iter_map[split][dataset]:
-            pred_mentions, mention_scores, gt_actions, pred_actions = model(document)
+            with get_autocast_context(amp_dtype):
+                pred_mentions, mention_scores, gt_actions, pred_actions = model(
+                    document
+                )
 
-            log_example = dict(document)
-            del log_example["tensorized_sent"]
-            for key in list(log_example.keys()):
-                if isinstance(log_example[key], Tensor):
-                    del log_example[key]
+            log_example = {
+                key: val for key, val in document.items() if key not in skip_keys
+            }
 
             predicted_clusters = action_sequences_to_clusters(
                 pred_actions, pred_mentions
@@ -329,7 +442,7 @@ def targeted_coref_evaluation(
             log_example["a_pred"] = a_pred
             log_example["b_pred"] = b_pred
             log_example["predicted_clusters"] = predicted_clusters
-            f.write(json.dumps(log_example) + "\n")
+            f.write(dump_json_line(log_example))
 
     logger.info(path.abspath(log_file))
 
@@ -358,6 +471,8 @@ def targeted_coref_evaluation(
     return result_dict
 
 
+# Inference mode skips the autograd bookkeeping such as version counters
+@torch.inference_mode()
 def coref_evaluation(
     config: DictConfig,
     model: EntityRankingModel,
@@ -366,13 +481,17 @@ def coref_evaluation(
     split="dev",
     final_eval=False,
     conll_data_dir: Dict = None,
+    amp_dtype: Optional[torch.dtype] = None,
 ) -> Dict:
-    """Evaluation function which calls the dataset-appropriate coreference evaluation function."""
+    """Evaluation function which calls the dataset-appropriate coreference evaluation function.
+
+    Inference runs under autocast with amp_dtype, i.e. the mixed precision the model was trained with.
+    """
 
     dataset_config = config.datasets[dataset]
     if dataset_config.get("targeted_eval", False):
         return targeted_coref_evaluation(
-            config, model, data_iter_map, dataset, split=split
+            config, model, data_iter_map, dataset, split=split, amp_dtype=amp_dtype
         )
     else:
         return full_coref_evaluation(
@@ -383,4 +502,5 @@ def coref_evaluation(
             split=split,
             final_eval=final_eval,
             conll_data_dir=conll_data_dir,
+            amp_dtype=amp_dtype,
         )